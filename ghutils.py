@@ -1,8 +1,80 @@
+import asyncio
+import functools
 import logging
 import os
-import subprocess
+import time
 
-from github import Github
+from github import Auth, Github, RateLimitExceededException
+from urllib3.util.retry import Retry
+
+# Caches shared across GitHubHandler instances so repeated construction for the
+# same token/repo/PR does not repeat the client setup and its HTTP round-trips
+_client_cache = {}
+_repo_cache = {}
+_pull_cache = {}
+
+logger = logging.getLogger(__name__)
+
+# Remaining core-API requests below which calls wait for the rate limit to reset
+_RATE_LIMIT_THRESHOLD = 50
+
+
+@functools.lru_cache(maxsize=1)
+def _resolve_token():
+    """
+    Resolves the GitHub token, honoring the SMARTEDITOR_GITHUB_TOKEN_OVERRIDE indirection.
+
+    Cached so repeated handler construction does not repeat the environment
+    lookups and logging.
+
+    Returns:
+        str: The resolved GitHub token, or None if no token is configured.
+    """
+    token_var_name = os.getenv('SMARTEDITOR_GITHUB_TOKEN_OVERRIDE')
+    if token_var_name:
+        github_token = os.getenv(token_var_name)
+        if github_token:
+            logger.info("Using custom token provided by the environment variable: %s", token_var_name)
+        else:
+            logger.error("The environment variable %s does not exist or is not set. Falling back to GITHUB_TOKEN.", token_var_name)
+            github_token = os.getenv('GITHUB_TOKEN')
+    else:
+        logger.debug("No custom token override provided; using GITHUB_TOKEN.")
+        github_token = os.getenv('GITHUB_TOKEN')
+    return github_token
+
+
+def rate_limited(fn):
+    """
+    Retries a GitHubHandler method when the GitHub API rate limit is exhausted.
+
+    Before each call the remaining core-API budget (tracked by PyGithub from
+    response headers, so no extra request is made) is checked; if it is nearly
+    exhausted, or the call raises RateLimitExceededException, the method sleeps
+    until the limit resets and then retries.
+
+    Args:
+        fn (callable): The GitHubHandler method to wrap.
+
+    Returns:
+        callable: The wrapped method.
+    """
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        while True:
+            remaining, _ = self.github_obj.rate_limiting
+            if 0 <= remaining < _RATE_LIMIT_THRESHOLD:
+                delay = max(0, self.github_obj.rate_limiting_resettime - time.time()) + 5
+                logger.warning("GitHub rate limit nearly exhausted (%d remaining). Sleeping for %.0fs", remaining, delay)
+                time.sleep(delay)
+            try:
+                return fn(self, *args, **kwargs)
+            except RateLimitExceededException:
+                reset_time = self.github_obj.get_rate_limit().core.reset.timestamp()
+                delay = max(0, reset_time - time.time()) + 5
+                logger.warning("GitHub rate limit exceeded. Sleeping for %.0fs before retrying %s", delay, fn.__name__)
+                time.sleep(delay)
+    return wrapper
 
 
 class GitHubHandler:
@@ -23,22 +95,75 @@ class GitHubHandler:
             pr_number (int): The number of the pull request within the repository.
             silent_mode (bool, optional): If True, operates in silent mode where comments are not posted. Defaults to False.
         """
-        token_var_name = os.getenv('SMARTEDITOR_GITHUB_TOKEN_OVERRIDE')
-        if token_var_name:
-            github_token = os.getenv(token_var_name)
-            if github_token:
-                logging.info(f"Using custom token provided by the environment variable: {token_var_name}")
-            else:
-                logging.error(f"The environment variable {token_var_name} does not exist or is not set. Falling back to GITHUB_TOKEN.")
-                github_token = os.getenv('GITHUB_TOKEN')
-        else:
-            logging.debug("No custom token override provided; using GITHUB_TOKEN.")
-            github_token = os.getenv('GITHUB_TOKEN')
+        github_token = _resolve_token()
+
+        if github_token not in _client_cache:
+            # A pooled connection with retries on transient upstream errors keeps
+            # every PyGithub call on a warm connection to api.github.com
+            _client_cache[github_token] = Github(
+                auth=Auth.Token(github_token) if github_token else None,
+                pool_size=20,
+                retry=Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504]),
+                user_agent='smarteditor-ghclient'
+            )
+        self.github_obj = _client_cache[github_token]
+
+        repo_key = (github_token, repo_name)
+        if repo_key not in _repo_cache:
+            _repo_cache[repo_key] = self.github_obj.get_repo(repo_name)
+        self.repo = _repo_cache[repo_key]
+
+        pull_key = (github_token, repo_name, pr_number)
+        if pull_key not in _pull_cache:
+            _pull_cache[pull_key] = self.repo.get_pull(pr_number)
+        self.pr = _pull_cache[pull_key]
 
-        self.github_obj = Github(github_token)
-        self.repo = self.github_obj.get_repo(repo_name)
-        self.pr = self.repo.get_pull(pr_number)
+        self._git_configured = False
+        self._file_status_cache = None
+        self._pr_patches = None
+        self._head_commit = None
 
+    def _gql(self, query, variables):
+        """
+        Executes a GraphQL query against the GitHub API.
+
+        Args:
+            query (str): The GraphQL query string.
+            variables (dict): Variables referenced by the query.
+
+        Returns:
+            dict: The decoded JSON response from the GraphQL endpoint.
+        """
+        _, data = self.github_obj._Github__requester.requestJsonAndCheck(
+            "POST", "/graphql", input={"query": query, "variables": variables}
+        )
+        return data
+
+    @rate_limited
+    def get_latest_comment_bodies(self, limit=100):
+        """
+        Retrieves the bodies of the most recent issue comments on the pull request, newest first.
+
+        A single GraphQL query fetches only the comment bodies, avoiding one REST
+        round-trip per page of comments.
+
+        Args:
+            limit (int, optional): Maximum number of comments to retrieve. Defaults to 100.
+
+        Returns:
+            List[str]: Comment bodies ordered from newest to oldest.
+        """
+        owner, name = self.repo.full_name.split('/')
+        query = (
+            "query($owner: String!, $name: String!, $number: Int!, $last: Int!) {"
+            " repository(owner: $owner, name: $name) {"
+            " pullRequest(number: $number) { comments(last: $last) { nodes { body } } } } }"
+        )
+        data = self._gql(query, {"owner": owner, "name": name, "number": self.pr.number, "last": limit})
+        nodes = data["data"]["repository"]["pullRequest"]["comments"]["nodes"]
+        return [node["body"] for node in reversed(nodes)]
+
+    @rate_limited
     def post_comment(self, message):
         """
         Posts a comment to the pull request.
@@ -48,6 +173,19 @@ class GitHubHandler:
         """
         self.pr.create_issue_comment(message)
 
+    @rate_limited
+    def create_review(self, comments):
+        """
+        Posts a batch of review comments on the pull request as a single review.
+
+        One POST carries all the comments, instead of one request per comment.
+
+        Args:
+            comments (list of dict): Review comment dicts with 'path', 'position' and 'body' keys.
+        """
+        self.pr.create_review(commit=self.get_head_commit(), body="", event="COMMENT", comments=comments)
+
+    @rate_limited
     def add_reaction_to_comment(self, comment_id, reaction_type):
         """
         Adds a reaction to a pull request comment.
@@ -57,79 +195,171 @@ class GitHubHandler:
             reaction_type (str): The type of reaction to add.
         """
         try:
-            comment = self.github_obj.get_repo(self.repo.full_name).get_issue(self.pr.number).get_comment(comment_id)
-            comment.create_reaction(reaction_type)
+            # Single REST POST; the comment ID is already known so there is no need to re-fetch repo, issue and comment
+            self.github_obj._Github__requester.requestJsonAndCheck(
+                "POST",
+                f"/repos/{self.repo.full_name}/issues/comments/{comment_id}/reactions",
+                input={"content": reaction_type},
+                headers={"Accept": "application/vnd.github.squirrel-girl-preview+json"}
+            )
         except Exception as e:
-            logging.error(f'Failed to add reaction to comment {comment_id}: {str(e)}')
+            logger.error('Failed to add reaction to comment %s: %s', comment_id, e)
 
-    def commit_and_push(self, updated_files, commit_message):
+    async def _run_git(self, *args, check=True):
         """
-        Commits and pushes specified files to the git repository.
+        Runs a git command without blocking the event loop.
 
         Args:
-            updated_files (list of str): File paths to commit.
-            commit_message (str): Commit message.
+            *args (str): Arguments passed to git.
+            check (bool, optional): If True, raises RuntimeError on a non-zero exit code. Defaults to True.
 
         Returns:
-            bool: True if successful, False otherwise.
+            Tuple[int, str, str]: The return code, stdout and stderr of the command.
         """
-        file_paths_str = "[" + ", ".join(updated_files) + "]"
-        logging.info(f"{file_paths_str} Initiating commit and push process")
+        proc = await asyncio.create_subprocess_exec(
+            'git', *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await proc.communicate()
+        if check and proc.returncode != 0:
+            raise RuntimeError(f"git {' '.join(args)} failed with exit code {proc.returncode}: {stderr.decode().strip()}")
+        return proc.returncode, stdout.decode(), stderr.decode()
+
+    async def _configure_git(self):
+        """
+        Configures the git identity and safe directory once per handler instance.
+        """
+        if self._git_configured:
+            return
 
         git_username = os.getenv('SMARTEDITOR_GITHUB_USERNAME') or 'github-actions'
         git_email = os.getenv('SMARTEDITOR_GITHUB_EMAIL') or 'github-actions@github.com'
 
         if os.getenv('SMARTEDITOR_GITHUB_USERNAME'):
-            logging.info(f"Using custom Git username: {git_username}")
+            logger.info("Using custom Git username: %s", git_username)
         else:
-            logging.info("Using default Git username: 'github-actions'")
+            logger.info("Using default Git username: 'github-actions'")
 
         if os.getenv('SMARTEDITOR_GITHUB_EMAIL'):
-            logging.info(f"Using custom Git email: {git_email}")
+            logger.info("Using custom Git email: %s", git_email)
         else:
-            logging.info("Using default Git email: 'github-actions@github.com'")
+            logger.info("Using default Git email: 'github-actions@github.com'")
+
+        # Configure Git to allow operations in the current directory
+        current_directory = os.getcwd()
+        await self._run_git('config', '--global', '--add', 'safe.directory', current_directory)
+        await self._run_git('config', '--global', 'user.name', git_username)
+        await self._run_git('config', '--global', 'user.email', git_email)
+        self._git_configured = True
+
+    async def commit_and_push(self, updated_files, commit_message):
+        """
+        Commits and pushes specified files to the git repository.
+
+        Args:
+            updated_files (list of str): File paths to commit.
+            commit_message (str): Commit message.
+
+        Returns:
+            bool: True if successful, False otherwise.
+        """
+        file_paths_str = "[" + ", ".join(updated_files) + "]"
+        logger.info("%s Initiating commit and push process", file_paths_str)
 
         try:
-            # Configure Git to allow operations in the current directory
-            current_directory = os.getcwd()
-            subprocess.run(['git', 'config', '--global', '--add', 'safe.directory', current_directory], check=True)
-            subprocess.run(['git', 'config', '--global', 'user.name', git_username], check=True)
-            subprocess.run(['git', 'config', '--global', 'user.email', git_email], check=True)
-
-            if subprocess.run(['git', 'status', '--porcelain'], capture_output=True, text=True).stdout:
-                subprocess.run(['git', 'add'] + updated_files, check=True)
-                commit_result = subprocess.run(['git', 'commit', '-m', commit_message], capture_output=True, text=True)
-
-                if commit_result.returncode == 0:
-                    logging.info(f"{file_paths_str} Changes committed successfully")
-                    push_result = subprocess.run(['git', 'push'], capture_output=True, text=True)
-                    if push_result.returncode == 0:
-                        logging.info(f"{file_paths_str} Changes pushed to remote repository successfully.")
+            await self._configure_git()
+
+            _, status_output, _ = await self._run_git('status', '--porcelain')
+            if status_output:
+                await self._run_git('add', *updated_files)
+                commit_returncode, _, _ = await self._run_git('commit', '-m', commit_message, check=False)
+
+                if commit_returncode == 0:
+                    logger.info("%s Changes committed successfully", file_paths_str)
+                    push_returncode, _, _ = await self._run_git('push', check=False)
+                    if push_returncode == 0:
+                        logger.info("%s Changes pushed to remote repository successfully.", file_paths_str)
                         return True
                     else:
-                        logging.error(f"{file_paths_str} Failed to push changes")
+                        logger.error("%s Failed to push changes", file_paths_str)
                         return False
                 else:
-                    logging.error(f"{file_paths_str} Failed to commit changes")
+                    logger.error("%s Failed to commit changes", file_paths_str)
                     return False
             else:
-                logging.info(f"{file_paths_str} No changes to commit")
+                logger.info("%s No changes to commit", file_paths_str)
                 return False
-        except subprocess.CalledProcessError as e:
-            logging.error(f"{file_paths_str} Error during git operations: {e}")
+        except RuntimeError as e:
+            logger.error("%s Error during git operations: %s", file_paths_str, e)
             return False
 
+    @rate_limited
     def get_file_status(self, file_path):
         """
         Retrieves the status of a file in the context of the pull request.
 
-        The method checks the list of files in the pull request and returns the status
-        of the specified file. The status can indicate whether the file is added, modified, or deleted.
+        The list of files in the pull request is fetched once and cached as a
+        {filename: status} dict, so repeated lookups cost no further API calls.
+        The status can indicate whether the file is added, modified, or deleted.
 
         Args:
             file_path (str): The relative path of the file in the repository for which the status is required.
         """
-        pr_files = self.pr.get_files()
-        return next(
-            (file.status for file in pr_files if file.filename == file_path), None
-        )
+        self._load_pr_files()
+        return self._file_status_cache.get(file_path)
+
+    def _load_pr_files(self):
+        """
+        Fetches the pull request file list once and populates the status and patch caches.
+        """
+        if self._file_status_cache is None:
+            pr_files = list(self.pr.get_files())
+            self._file_status_cache = {file.filename: file.status for file in pr_files}
+            self._pr_patches = {file.filename: file.patch for file in pr_files}
+
+    @rate_limited
+    def get_changed_filenames(self, statuses=None):
+        """
+        Retrieves the paths of files changed in the pull request.
+
+        Args:
+            statuses (tuple of str, optional): If given, only files whose status is in this collection are returned.
+
+        Returns:
+            List[str]: The relative paths of the changed files.
+        """
+        self._load_pr_files()
+        return [
+            filename for filename, status in self._file_status_cache.items()
+            if statuses is None or status in statuses
+        ]
+
+    @rate_limited
+    def get_patch(self, file_path):
+        """
+        Retrieves the unified diff patch of a file in the pull request.
+
+        The patches for all files in the pull request are fetched once and cached,
+        so repeated lookups (one per violation) cost no further API calls.
+
+        Args:
+            file_path (str): The relative path of the file in the repository.
+
+        Returns:
+            str: The patch text, or None if the file is not part of the pull request.
+        """
+        self._load_pr_files()
+        return self._pr_patches.get(file_path)
+
+    @rate_limited
+    def get_head_commit(self):
+        """
+        Retrieves the head commit of the pull request, cached after the first call.
+
+        Returns:
+            Commit: The commit object for the head of the pull request.
+        """
+        if self._head_commit is None:
+            self._head_commit = self.repo.get_commit(self.pr.head.sha)
+        return self._head_commit
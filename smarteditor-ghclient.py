@@ -1,23 +1,84 @@
 import asyncio
+import hashlib
 import logging
 import os
+import random
 import re
+import time
 
+import aiofiles
 import aiohttp
+import orjson
+from aiolimiter import AsyncLimiter
 
 from ghutils import GitHubHandler
 
-logging.basicConfig(level=logging.DEBUG,
+logging.basicConfig(level=logging.INFO,
                     format='%(levelname)s [%(asctime)s] %(message)s',
                     datefmt='%d-%m-%Y %H:%M:%S')
 
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FILE_TYPES = ('.md', '.mdx', '.ipynb')
+
+SMARTEDITOR_TIMEOUT = 240
+SMARTEDITOR_MAX_ATTEMPTS = 5
+
+# Responses are cached on disk keyed by file content hash, so re-submitting an
+# unchanged file (e.g. a review followed by --commit) skips the LLM round-trip
+_CACHE_DIR = os.getenv('SMARTEDITOR_CACHE_DIR', '.smarteditor-cache')
+_CACHE_TTL = int(os.getenv('SMARTEDITOR_CACHE_TTL', '86400'))
+
+# HTTP statuses worth retrying: rate limiting and transient upstream failures
+_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# Patterns are static, so compile them once at import instead of on every call.
+# A single pattern with an optional --commit group means one scan of the comment body yields both the file path and the mode.
+# Extensions go longest-first so '.md' cannot end a match early inside '.mdx', and the
+# trailing boundary stops the optional --commit group from truncating the path.
+_FILE_TYPES_REGEX = r"(" + '|'.join(sorted(map(re.escape, SUPPORTED_FILE_TYPES), key=len, reverse=True)) + r")"
+_CMD_RE = re.compile(rf'/smarteditor\s+([\w/.\-\\]*[\w.\-]+{_FILE_TYPES_REGEX})(?:\s+(--commit))?(?=\s|$)')
+_ALL_CMD_RE = re.compile(r'/smarteditor\s+--all')
+_SMARTEDITOR_COMMENT_RE = re.compile(r"\*\*Original:\*\*\s(.*?)\n\*\*Revised:\*\*\s(.*?)\n\*\*Explanation:\*\*", re.DOTALL)
+
+
+def _build_diff_index(patch):
+    """
+    Indexes the added lines of a unified diff patch.
+
+    Args:
+        patch (str): The unified diff text of a file.
+
+    Returns:
+        List[Tuple[int, str]]: Pairs of (diff position, line text without the leading '+').
+    """
+    return [
+        (i, line[line.find('+')+1:])
+        for i, line in enumerate(patch.split('\n'))
+        if line.startswith('+')
+    ]
+
 
 class SmartEditorHandler:
     """
     Handles retrieval and updating of suggestions.
     """
-    def __init__(self):
-        pass
+    def __init__(self, semaphore=None, limiter=None):
+        """
+        Initializes the SmartEditorHandler.
+
+        The semaphore caps how many requests are in flight at once; the limiter
+        caps how many start per minute. Both are needed: a burst of short
+        requests can respect the concurrency cap yet still trip the endpoint's
+        per-minute quota.
+
+        Args:
+            semaphore (asyncio.Semaphore, optional): Caps the number of concurrent requests to the SmartEditor service.
+            limiter (AsyncLimiter, optional): Caps the rate of requests to the SmartEditor service per minute.
+        """
+        self._sem = semaphore or asyncio.Semaphore(int(os.getenv('SMARTEDITOR_MAX_CONCURRENCY', '8')))
+        self._limiter = limiter or AsyncLimiter(max_rate=int(os.getenv('SMARTEDITOR_RPM', '60')), time_period=60)
+        self._diff_index_cache = {}
 
     async def send_to_smarteditor(self, session, file_path, text, smarteditor_endpoint):
         """
@@ -32,26 +93,61 @@ class SmartEditorHandler:
         Returns:
             Dict: A dictionary containing the success status and data from the SmartEditor service.
         """
-        SMARTEDITOR_TIMEOUT = 240
         response_structure = {"success": False, "data": None}
 
-        logging.info(f'[{file_path}] Sending request to SMARTEDITOR_ENDPOINT')
-        headers = {
-            "Content-Type": "application/json",
-            "X-API-Token": os.getenv('SMARTEDITOR_TOKEN')
-        }
-        payload = {"text": text}
+        cache_path = os.path.join(_CACHE_DIR, hashlib.blake2b(text.encode(), digest_size=16).hexdigest() + '.json')
         try:
-            async with session.post(smarteditor_endpoint, json=payload, headers=headers, timeout=SMARTEDITOR_TIMEOUT) as response:
-                response.raise_for_status()
-                response_structure["data"] = await response.json()
+            if time.time() - os.path.getmtime(cache_path) < _CACHE_TTL:
+                async with aiofiles.open(cache_path, 'rb') as cache_file:
+                    response_structure["data"] = orjson.loads(await cache_file.read())
                 response_structure["success"] = True
-        except asyncio.TimeoutError:
-            logging.error(f'[{file_path}] Request to SMARTEDITOR_ENDPOINT timed out')
-        except aiohttp.ClientResponseError as e:
-            logging.error(f'[{file_path}] HTTP Response Error: {e}')
-        except Exception as e:
-            logging.error(f'[{file_path}] An unexpected error occurred: {e}')
+                logger.info('[%s] Serving SMARTEDITOR response from cache', file_path)
+                return response_structure
+        except (OSError, orjson.JSONDecodeError):
+            pass
+
+        logger.info('[%s] Sending request to SMARTEDITOR_ENDPOINT', file_path)
+        # Serialize once up front with orjson; the resulting bytes are reused across retries
+        payload = orjson.dumps({"text": text})
+        for attempt in range(SMARTEDITOR_MAX_ATTEMPTS):
+            last_attempt = attempt == SMARTEDITOR_MAX_ATTEMPTS - 1
+            retry_delay = None
+            try:
+                # The limiter and semaphore wrap each request individually: the former
+                # bounds requests per minute, the latter bounds in-flight requests
+                async with self._limiter, self._sem:
+                    async with session.post(smarteditor_endpoint, data=payload) as response:
+                        if response.status in _RETRYABLE_STATUSES and not last_attempt:
+                            retry_delay = float(response.headers.get('Retry-After', 2 ** attempt)) + random.uniform(0, 0.5)
+                            logger.warning('[%s] SMARTEDITOR_ENDPOINT returned %d. Retrying in %.1fs', file_path, response.status, retry_delay)
+                        else:
+                            response.raise_for_status()
+                            response_structure["data"] = await response.json(loads=orjson.loads)
+                            response_structure["success"] = True
+
+                            try:
+                                os.makedirs(_CACHE_DIR, exist_ok=True)
+                                async with aiofiles.open(cache_path, 'wb') as cache_file:
+                                    await cache_file.write(orjson.dumps(response_structure["data"]))
+                            except OSError as e:
+                                logger.warning('[%s] Failed to write SMARTEDITOR response cache: %s', file_path, e)
+
+                            return response_structure
+            except asyncio.TimeoutError:
+                if last_attempt:
+                    logger.error('[%s] Request to SMARTEDITOR_ENDPOINT timed out', file_path)
+                    break
+                retry_delay = 2 ** attempt + random.uniform(0, 0.5)
+                logger.warning('[%s] Request to SMARTEDITOR_ENDPOINT timed out. Retrying in %.1fs', file_path, retry_delay)
+            except aiohttp.ClientResponseError as e:
+                logger.error('[%s] HTTP Response Error: %s', file_path, e)
+                break
+            except Exception as e:
+                logger.error('[%s] An unexpected error occurred: %s', file_path, e)
+                break
+
+            # Back off outside the limiter/semaphore so waiting does not hold a slot
+            await asyncio.sleep(retry_delay)
 
         return response_structure
 
@@ -71,40 +167,50 @@ class SmartEditorHandler:
         ]
         return '\n'.join(formatted_suggestions)
 
-    def post_review_comment_on_violation(self, file_path, violation, github_handler, pr_number):
+    def build_review_comments(self, file_path, violations, github_handler):
         """
-        Posts a review comment on a specific line of a file in a pull request, highlighting an instance of a violation.
+        Builds the review comments for all violations found in a file.
+
+        Each comment targets the line in the pull request diff where the original
+        sentence appears; the comments are posted later as a single review.
 
         Args:
             file_path (str): The path of the file within the pull request.
-            violation (dict): A dictionary containing details about the violation, including original and suggested text.
+            violations (List[Dict]): Dictionaries containing details about each violation, including original and suggested text.
             github_handler (GitHubHandler): An instance of GitHubHandler for GitHub interaction.
-            pr_number (int): The number of the pull request.
-        """
-        pr = github_handler.repo.get_pull(pr_number)
-        commit_obj = github_handler.repo.get_commit(pr.head.sha)
 
-        files = pr.get_files()
-        for file in files:
-            if file.filename == file_path:
-                file_diff = file.patch
-                break
-        else:
-            logging.warning(f"[{file_path}] File not found in pull request")
-            return
+        Returns:
+            List[Dict]: Review comment dicts with 'path', 'position' and 'body' keys.
+        """
+        file_diff = github_handler.get_patch(file_path)
+        if file_diff is None:
+            logger.warning("[%s] File not found in pull request", file_path)
+            return []
 
         # Locating the exact line in the file diff where the original sentence appears.
-        diff_lines = file_diff.split('\n')
-        for i, line in enumerate(diff_lines):
-            if violation['original_sentence'] in line:
-                position = i
-                line_text = line[line.find('+')+1:]  # Skip the diff '+'
+        # The diff is split and indexed once per file, then shared across violations.
+        if file_path not in self._diff_index_cache:
+            self._diff_index_cache[file_path] = _build_diff_index(file_diff)
+
+        # A single pass over the indexed lines locates every violation at once,
+        # rather than re-walking the diff per violation
+        hits = {i: [] for i in range(len(violations))}
+        for position, line_text in self._diff_index_cache[file_path]:
+            for i, violation in enumerate(violations):
+                if violation['original_sentence'] in line_text:
+                    hits[i].append((position, line_text))
+
+        comments = []
+        for i, violation in enumerate(violations):
+            for position, line_text in hits[i]:
                 updated_line = line_text.replace(violation['original_sentence'], violation['revised_sentence'])
 
                 review_message = f"**Suggested Change:**\n```suggestion\n{updated_line}\n```\n"
                 review_message += f"**Explanation:** {violation['clear_explanation']}"
-                pr.create_review_comment(review_message, commit_obj, file_path, position)
-                logging.info(f"[{file_path}] Posted a review comment for instance of a violation on line {position}")
+                comments.append({"path": file_path, "position": position, "body": review_message})
+                logger.info("[%s] Built a review comment for instance of a violation on line %d", file_path, position)
+
+        return comments
 
 
 def parse_smarteditor_comment(file_path, comment_body):
@@ -118,15 +224,15 @@ def parse_smarteditor_comment(file_path, comment_body):
     Returns:
         List[Tuple[str, str]]: A list of tuples where each tuple contains an original sentence and its revised version.
     """
-    logging.debug(f"[{file_path}] Parsing smarteditor command comment: {comment_body}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[%s] Parsing smarteditor command comment: %s", file_path, comment_body)
 
-    pattern = re.compile(r"\*\*Original:\*\*\s(.*?)\n\*\*Revised:\*\*\s(.*?)\n\*\*Explanation:\*\*", re.DOTALL)
-    matches = pattern.findall(comment_body)
+    matches = _SMARTEDITOR_COMMENT_RE.findall(comment_body)
 
     if not matches:
-        logging.warning(f"[{file_path}] No matches found in smarteditor comment. Review regex pattern and comment format")
+        logger.warning("[%s] No matches found in smarteditor comment. Review regex pattern and comment format", file_path)
     else:
-        logging.info(f"[{file_path}] Extracted tuples from smarteditor comment: {matches}")
+        logger.info("[%s] Extracted %d tuples from smarteditor comment", file_path, len(matches))
 
     return matches
 
@@ -140,48 +246,55 @@ async def commit_edited_file(github_handler, file_path, pr_number):
         file_path (str): The path of the file that was edited.
         pr_number (int): The number of the pull request associated with the file.
     """
-    pr = github_handler.repo.get_pull(pr_number)
-    comments = pr.get_issue_comments()
+    # One GraphQL round-trip for the latest comment bodies instead of paging through the full comment history
+    comment_bodies = await asyncio.to_thread(github_handler.get_latest_comment_bodies)
 
-    # Convert PaginatedList to a list and reverse it to start from the latest comment
-    pr_comments = list(comments)
-    pr_comments.reverse()
-
-    latest_review_comment = next(
+    latest_review_comment_body = next(
         (
-            comment
-            for comment in pr_comments
-            if f"SMARTEDITOR suggestions for `{file_path}`" in comment.body
+            body
+            for body in comment_bodies
+            if f"SMARTEDITOR suggestions for `{file_path}`" in body
         ),
         None,
     )
-    if not latest_review_comment:
-        logging.error(f"[{file_path}] Failed to find smarteditor review comment. Unable to proceed with commit")
+    if not latest_review_comment_body:
+        logger.error("[%s] Failed to find smarteditor review comment. Unable to proceed with commit", file_path)
         return
 
-    suggestions = parse_smarteditor_comment(file_path, latest_review_comment.body)
-    logging.info(f"[{file_path}] Extracted tuples from smarteditor comment: {suggestions}")
-    with open(file_path, 'r') as file:
-        content = file.read()
+    suggestions = parse_smarteditor_comment(file_path, latest_review_comment_body)
+    logger.info("[%s] Extracted %d tuples from smarteditor comment", file_path, len(suggestions))
+    async with aiofiles.open(file_path, 'r') as file:
+        content = await file.read()
 
+    # A single regex alternation pass replaces all originals in O(N) instead of one full scan per suggestion
+    replacements = dict(suggestions)
     replacements_made = 0
-    for original, revised in suggestions:
-        if original in content:
-            content = content.replace(original, revised)
-            replacements_made += 1
-            logging.info(f"[{file_path}] Replaced: '{original}' with '{revised}'")
-        else:
-            logging.warning(f"[{file_path}] Original sentence not found in file: '{original}'")
+    if replacements:
+        # Longest originals first, so a shorter alternative cannot shadow a longer one that contains it
+        pattern = re.compile('|'.join(sorted(map(re.escape, replacements), key=len, reverse=True)))
+        matched = set()
 
-    logging.info(f"[{file_path}] Total text replacements made in file: {replacements_made}")
+        def substitute(match):
+            matched.add(match.group(0))
+            return replacements[match.group(0)]
+
+        content, replacements_made = pattern.subn(substitute, content)
+
+        for original, revised in suggestions:
+            if original in matched:
+                logger.info("[%s] Replaced: '%s' with '%s'", file_path, original, revised)
+            else:
+                logger.warning("[%s] Original sentence not found in file: '%s'", file_path, original)
+
+    logger.info("[%s] Total text replacements made in file: %d", file_path, replacements_made)
 
     if replacements_made > 0:
-        with open(file_path, 'w') as file:
-            file.write(content)
+        async with aiofiles.open(file_path, 'w') as file:
+            await file.write(content)
 
-        github_handler.commit_and_push([file_path], f"Posted a commit comment for file: {file_path}")
+        await github_handler.commit_and_push([file_path], f"Posted a commit comment for file: {file_path}")
     else:
-        logging.info(f"[{file_path}] No text replacements required. Skipping the commit process")
+        logger.info("[%s] No text replacements required. Skipping the commit process", file_path)
 
 
 async def process_file(session, file_path, smarteditor_handler, github_handler, smarteditor_endpoint, pr_number):
@@ -196,25 +309,31 @@ async def process_file(session, file_path, smarteditor_handler, github_handler,
         smarteditor_endpoint (str): The SmartEditor service URL.
         pr_number (int): The pull request number associated with the file.
     """
-    logging.info(f"[{file_path}] Starting review")
+    logger.info("[%s] Starting review", file_path)
 
     try:
-        with open(file_path, 'r') as file:
-            content = file.read()
+        # Check the PR membership first: a miss costs one cached lookup and skips the expensive SMARTEDITOR call
+        file_status = await asyncio.to_thread(github_handler.get_file_status, file_path)
+        if file_status is None:
+            logger.warning("[%s] File not found in pull request. Skipping review", file_path)
+            await asyncio.to_thread(github_handler.post_comment, f"File `{file_path}` was not found in this pull request.")
+            return
+
+        async with aiofiles.open(file_path, 'r') as file:
+            content = await file.read()
 
         response = await smarteditor_handler.send_to_smarteditor(session, file_path, content, smarteditor_endpoint)
 
         if not response["success"]:
-            logging.error(f"[{file_path}] Failed to get a response from SMARTEDITOR_ENDPOINT.")
-            github_handler.post_comment(f"Failed to get a response from the SMARTEDITOR_ENDPOINT for file `{file_path}`. Please check the logs for more details.")
+            logger.error("[%s] Failed to get a response from SMARTEDITOR_ENDPOINT.", file_path)
+            await asyncio.to_thread(github_handler.post_comment, f"Failed to get a response from the SMARTEDITOR_ENDPOINT for file `{file_path}`. Please check the logs for more details.")
             return
 
         if not response["data"].get('violations'):
-            logging.info(f"[{file_path}] No instances of sentences with style guide rule violations found")
-            github_handler.post_comment(f"There appear to be no instances of sentences that violate the style guide rules in `{file_path}`.")
+            logger.info("[%s] No instances of sentences with style guide rule violations found", file_path)
+            await asyncio.to_thread(github_handler.post_comment, f"There appear to be no instances of sentences that violate the style guide rules in `{file_path}`.")
             return
 
-        file_status = github_handler.get_file_status(file_path)
         run_url = response["data"].get('run_url')
         run_url_text = f"[Explore how the LLM generated them.]({run_url})" if run_url else ""
 
@@ -222,10 +341,13 @@ async def process_file(session, file_path, smarteditor_handler, github_handler,
             review_comment = f"SMARTEDITOR suggestions for `{file_path}` posted below."
             if run_url:
                 review_comment += f" {run_url_text}"
-            github_handler.post_comment(review_comment)
+            await asyncio.to_thread(github_handler.post_comment, review_comment)
 
-            for violation in response["data"]['violations']:
-                smarteditor_handler.post_review_comment_on_violation(file_path, violation, github_handler, pr_number)
+            comments = await asyncio.to_thread(
+                smarteditor_handler.build_review_comments, file_path, response["data"]['violations'], github_handler
+            )
+            if comments:
+                await asyncio.to_thread(github_handler.create_review, comments)
 
         elif file_status == 'modified':
             formatted_response = smarteditor_handler.format_smarteditor_suggestions(response["data"]['violations'])
@@ -234,11 +356,11 @@ async def process_file(session, file_path, smarteditor_handler, github_handler,
                 final_comment += run_url_text
 
             final_comment += f" Use `smarteditor {file_path} --commit` to commit all suggestions."
-            github_handler.post_comment(final_comment)
+            await asyncio.to_thread(github_handler.post_comment, final_comment)
 
     except Exception as e:
-        logging.error(f"[{file_path}] Error processing file: {e}")
-        github_handler.post_comment(f"Error processing file `{file_path}`. Please check the logs for more details.")
+        logger.error("[%s] Error processing file: %s", file_path, e)
+        await asyncio.to_thread(github_handler.post_comment, f"Error processing file `{file_path}`. Please check the logs for more details.")
 
 
 async def main():
@@ -254,34 +376,71 @@ async def main():
     pr_number = int(pr_number) if pr_number else None
     comment_id = int(comment_id) if comment_id else None
 
-    logging.debug(f"Received comment body (raw): {repr(comment_body)}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received comment body (raw): %r", comment_body)
 
-    github_handler = GitHubHandler(repo_name, pr_number)
+    # Handler construction fetches the repo and PR over HTTP, so keep it off the event loop too
+    github_handler = await asyncio.to_thread(GitHubHandler, repo_name, pr_number)
     smarteditor_handler = SmartEditorHandler()
 
-    SUPPORTED_FILE_TYPES = ['.md', '.mdx', '.ipynb']
-    file_types_regex = r"(" + '|'.join(re.escape(ext) for ext in SUPPORTED_FILE_TYPES) + r")"
-
-    if commit_match := re.search(
-        rf'/smarteditor\s+([\w/.\-\\]*[\w.\-]+{file_types_regex})\s+--commit', comment_body
-    ):
-        file_path = commit_match[1].replace('\\', '/')
-        logging.info(f"[{file_path}] Commit command identified")
-        await commit_edited_file(github_handler, file_path, pr_number)
-
-    elif file_path_match := re.search(
-        rf'/smarteditor\s+([\w/.\-\\]*[\w.\-]+{file_types_regex})', comment_body
-    ):
-        file_path = file_path_match[1].replace('\\', '/')
-        logging.info(f"[{file_path}] File path identified")
-
-        async with aiohttp.ClientSession() as session:
-            await process_file(session, file_path, smarteditor_handler, github_handler, smarteditor_endpoint, pr_number)
+    # One scan of the comment body collects every command together with its mode
+    commit_paths = []
+    review_paths = []
+    all_command = bool(_ALL_CMD_RE.search(comment_body))
+    if all_command:
+        # Review every supported file changed in the PR; concurrency stays
+        # bounded by the SmartEditor semaphore and rate limiter. Removed files
+        # no longer exist on disk, so only added/modified ones qualify
+        changed_files = await asyncio.to_thread(github_handler.get_changed_filenames, ('added', 'modified'))
+        review_paths = [file_path for file_path in changed_files if file_path.endswith(SUPPORTED_FILE_TYPES)]
+        logger.info("Reviewing all %d supported changed files in the pull request", len(review_paths))
     else:
-        logging.info("No valid command found in the comment.")
-
-        supported_types_formatted = ", ".join(f"`{ext}`" for ext in SUPPORTED_FILE_TYPES)
-        github_handler.post_comment(f"No valid command found in the comment. Supported file types are: {supported_types_formatted}")
+        for match in _CMD_RE.finditer(comment_body):
+            file_path = match.group(1).replace('\\', '/')
+            if match.group(3):
+                logger.info("[%s] Commit command identified", file_path)
+                commit_paths.append(file_path)
+            else:
+                logger.info("[%s] File path identified", file_path)
+                review_paths.append(file_path)
+
+    # One session for the lifetime of the run: pooled keep-alive connections and
+    # a cached DNS lookup let all requests reuse warm connections to the
+    # SMARTEDITOR endpoint, with auth and content-type set once at session level
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=20, keepalive_timeout=75, ttl_dns_cache=300)
+    # Fine-grained limits: a dead endpoint fails on connect within seconds.
+    # sock_read gets the full budget because the LLM can legally stay silent
+    # for minutes before the first response byte arrives
+    timeout = aiohttp.ClientTimeout(total=SMARTEDITOR_TIMEOUT, connect=5, sock_connect=5, sock_read=SMARTEDITOR_TIMEOUT)
+    async with aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        headers={
+            "Content-Type": "application/json",
+            "X-API-Token": os.getenv('SMARTEDITOR_TOKEN') or ''
+        },
+        json_serialize=lambda obj: orjson.dumps(obj).decode()
+    ) as session:
+        if commit_paths:
+            # Commits share one working tree and remote branch, so they must run
+            # sequentially: concurrent git add/commit/push would race on the
+            # index lock and lose commits to non-fast-forward pushes
+            for file_path in commit_paths:
+                await commit_edited_file(github_handler, file_path, pr_number)
+
+        elif review_paths:
+            await asyncio.gather(*[
+                process_file(session, file_path, smarteditor_handler, github_handler, smarteditor_endpoint, pr_number)
+                for file_path in review_paths
+            ])
+        else:
+            supported_types_formatted = ", ".join(f"`{ext}`" for ext in SUPPORTED_FILE_TYPES)
+            if all_command:
+                logger.info("No supported files changed in the pull request.")
+                await asyncio.to_thread(github_handler.post_comment, f"No added or modified files of the supported types ({supported_types_formatted}) were found in this pull request.")
+            else:
+                logger.info("No valid command found in the comment.")
+                await asyncio.to_thread(github_handler.post_comment, f"No valid command found in the comment. Supported file types are: {supported_types_formatted}")
 
 if __name__ == "__main__":
     asyncio.run(main())